@@ -3,8 +3,17 @@ This script converts .kicad_wks files to FreeCAD TechDraw compatible .svg
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from lisp_like_parser import parse
-from pprint import pprint
+
+try:
+    # numba is optional; when present the coordinate-transform kernel is
+    # jit-compiled, otherwise it runs as plain python
+    from numba import njit
+except ImportError:
+    def njit(**kwargs):
+        return lambda f: f
 
 # A size paper dimensions in mm
 iso_pages = {
@@ -28,159 +37,235 @@ eq_editable = {
 
 }
 
-def to_svg(ast):
-    # ast transformer to convert tokens to svg
-    result = ""
-    cmd = ast[0]
-    if cmd == "page_layout":
-        result += f"""<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+# constant SVG boilerplate for each element type, hoisted out of the
+# per-element emitters.  .format on a prebuilt template reuses the parsed
+# format spec instead of rebuilding an f-string on every call
+_HEADER_FMT = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
 <!-- Generated with KiCAD2TechDraw: https://github.com/alexneufeld/KiCAD2TechDraw -->
 <!-- Based on templates created by the KICAD developers: https://gitlab.com/kicad/libraries/kicad-templates -->
 
 <svg
     xmlns="http://www.w3.org/2000/svg" version="1.1"
     xmlns:freecad="http://www.freecadweb.org/wiki/index.php?title=Svg_Namespace"
-    width="{PAGE_SIZE[0]}mm"
-    height="{PAGE_SIZE[1]}mm"
-    viewBox="0 0 {PAGE_SIZE[0]} {PAGE_SIZE[1]}">\n"""
-        for sub_ast in ast[1:]:
-            result += to_svg(sub_ast)
-        result += "</svg>\n"
-    elif cmd == "setup":
-        global LINE_WIDTH
-        LINE_WIDTH = ast[2][1]
-        global LEFT_MARGIN
-        LEFT_MARGIN = ast[4][1]
-        global RIGHT_MARGIN
-        RIGHT_MARGIN = ast[5][1]
-        global TOP_MARGIN
-        TOP_MARGIN = ast[6][1]
-        global BOTTOM_MARGIN
-        BOTTOM_MARGIN = ast[7][1]
-    elif cmd == "line":
-        x1, y1 = parse_coord(ast[2])
-        x2, y2 = parse_coord(ast[3])
-        linewidth = ast[4][1]#*LINE_WIDTH
-        ident = ast[1][1]
-        # NOTE - 75% of spec'd linewidth seems to produce the most accurate results
-        result += f'<line id="{ident}" x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" style="stroke: black; stroke-width: {0.75*linewidth}pt; stroke-linecap: round; stroke-linejoin:round;"/>\n'
-    elif cmd == "rect":
-        x1, y1 = parse_coord(ast[2])
-        x2, y2 = parse_coord(ast[3])
-        if x2 > x1:
-            width=x2-x1
-            xs = x1
-        else:
-            width=x1-x2
-            xs=x2
-        if y2 > y1:
-            height=y2-y1
-            ys = y1
-        else:
-            height=y1-y2
-            ys = y2
-        linewidth = ast[4][1]#*LINE_WIDTH
-        rect_name = ast[1][1]
-        result += f'<rect x="{xs}" y="{ys}" width="{width}" height="{height}" id="{rect_name}" style="stroke: black; stroke-width: {0.75*linewidth}pt; stroke-linecap: round; stroke-linejoin: round; fill: none;"/>\n'
-    elif cmd == "tbtext":
-        # need to handle either static or editable text
-        # quoted sentences also get split to multiple tokens 
-        # It's all just a mess
-        actual_text = []
-        for subitem in ast[1:]:
-            if type(subitem) != list:
-                actual_text.append(str(subitem))
-            else:
-                break
-        text_str = " ".join(actual_text).strip('"')
-        rem = ast[len(actual_text)+1:]
-        #print(text_str)
-        xpos, ypos = [0,0]
-        text_justify = "left"
-        text_height = 3.14159263
-        text_id = "No_ID"
-        for item in rem:
-            if item[0] == "pos":
-                xpos,ypos = parse_coord(item)
-            elif item[0] == "justify":
-                text_justify = item[1]
-            elif item[0] == "font":
-                text_height = item[2][2]
-            elif item[0] == "name":
-                text_id = item[1]
-        if text_justify == "left":
-            anchor = "start"
-        else:
-            anchor = "middle"
+    width="{0}mm"
+    height="{1}mm"
+    viewBox="0 0 {0} {1}">\n""".format
+_LINE_FMT = '<line id="{}" x1="{}" y1="{}" x2="{}" y2="{}" style="stroke: black; stroke-width: {}pt; stroke-linecap: round; stroke-linejoin:round;"/>\n'.format
+_RECT_FMT = '<rect x="{}" y="{}" width="{}" height="{}" id="{}" style="stroke: black; stroke-width: {}pt; stroke-linecap: round; stroke-linejoin: round; fill: none;"/>\n'.format
+_TEXT_FMT = '<text x="{}" y="{}" transform="translate(0,{})" id="{}" style="font-size: {}pt; text-anchor: {}; fill: black; font-family: osifont">{}</text>\n'.format
+_EDIT_TEXT_FMT = '<text freecad:editable="{}" x="{}" y="{}" transform="translate(0,{})" id="{}" style="font-size: {}pt; text-anchor: {}; fill: black; font-family: osifont"><tspan>x</tspan></text>\n'.format
+_POLYGON_FMT = '<g transform="translate({},{})"><polygon id="{}" transform="rotate({})" points="{}" style="fill: solid black; stroke-width: {}pt; stroke-linecap: round; stroke-linejoin: round;"/></g>\n'.format
+
+def _f(v):
+    # trim a numeric field for output: 4 decimals is ample for mm-scale
+    # coordinates, and stripping trailing zeros keeps the svg compact
+    return f"{v:.4f}".rstrip('0').rstrip('.')
+
+class Ctx:
+    # per-worksheet state: page size, margins and default linewidth.
+    # threaded through to_svg/parse_coord instead of module globals so
+    # reads are cheap attribute/local lookups and files don't share state
+    __slots__ = ('pw', 'ph', 'lm', 'rm', 'tm', 'bm', 'lw', 'pc')
+
+    def __init__(self):
+        # specialized coordinate transform, generated once setup is seen
+        self.pc = None
+
+def _emit_setup(ast, ctx, out):
+    ctx.lw = ast[2][1]
+    lm = ctx.lm = ast[4][1]
+    rm = ctx.rm = ast[5][1]
+    tm = ctx.tm = ast[6][1]
+    bm = ctx.bm = ast[7][1]
+    # page size and margins are fixed for the rest of the sheet, so
+    # generate a transform with them folded in as bytecode constants
+    src = (
+        "def pc(xi, yi, rel):\n"
+        "    if rel == 0:\n"
+        f"        return xi+{lm!r}, yi+{tm!r}\n"
+        "    elif rel == 1:\n"
+        f"        return xi+{lm!r}, {ctx.ph-bm!r}-yi\n"
+        "    elif rel == 2:\n"
+        f"        return {ctx.pw-rm!r}-xi, yi+{tm!r}\n"
+        f"    return {ctx.pw-rm!r}-xi, {ctx.ph-bm!r}-yi\n"
+    )
+    ns = {}
+    exec(src, ns)
+    ctx.pc = ns["pc"]
+
+def _emit_line(ast, ctx, out):
+    x1, y1 = parse_coord(ast[2], ctx)
+    x2, y2 = parse_coord(ast[3], ctx)
+    linewidth = ast[4][1]#*ctx.lw
+    ident = ast[1][1]
+    # NOTE - 75% of spec'd linewidth seems to produce the most accurate results
+    out += _LINE_FMT(ident, _f(x1), _f(y1), _f(x2), _f(y2), _f(0.75*linewidth)).encode()
+
+def _emit_rect(ast, ctx, out):
+    x1, y1 = parse_coord(ast[2], ctx)
+    x2, y2 = parse_coord(ast[3], ctx)
+    if x2 > x1:
+        width=x2-x1
+        xs = x1
+    else:
+        width=x1-x2
+        xs=x2
+    if y2 > y1:
+        height=y2-y1
+        ys = y1
+    else:
+        height=y1-y2
+        ys = y2
+    linewidth = ast[4][1]#*ctx.lw
+    rect_name = ast[1][1]
+    out += _RECT_FMT(_f(xs), _f(ys), _f(width), _f(height), rect_name, _f(0.75*linewidth)).encode()
+
+def _emit_tbtext(ast, ctx, out):
+    # need to handle either static or editable text
+    # quoted sentences also get split to multiple tokens 
+    # It's all just a mess
+    # the text is every leading non-list token; find where the attribute
+    # lists begin in one scan rather than collecting and recounting
+    split = next((i for i, s in enumerate(ast[1:], 1) if isinstance(s, list)), len(ast))
+    text_str = " ".join(map(str, ast[1:split])).strip('"')
+    rem = ast[split:]
+    #print(text_str)
+    # index the attribute lists by keyword in one pass instead of
+    # comparing every item against every keyword
+    attrs = {item[0]: item for item in rem if isinstance(item, list)}
+    if "pos" in attrs:
+        xpos, ypos = parse_coord(attrs["pos"], ctx)
+    else:
+        xpos, ypos = 0, 0
+    text_justify = attrs["justify"][1] if "justify" in attrs else "left"
+    text_height = attrs["font"][2][2] if "font" in attrs else 3.14159263
+    text_id = attrs["name"][1] if "name" in attrs else "No_ID"
+    if text_justify == "left":
+        anchor = "start"
+    else:
+        anchor = "middle"
+    # a single dict lookup decides static vs editable, and unknown
+    # %-codes fall back to static text instead of raising KeyError
+    mapped = eq_editable.get(text_str)
+    if mapped is None:
         # static text
-        if not text_str.startswith("%"):
-            # assign defaults
-            # NOTE: dy="{0.35*text_height}pt" compensates for differences between osifont and KiCAD's typical font geometry
-            result += f'<text x="{xpos}" y="{ypos}" transform="translate(0,{0.35*text_height})" id="{text_id}" style="font-size: {text_height}pt; text-anchor: {anchor}; fill: black; font-family: osifont">{text_str}</text>\n'
-        else: # editable text
-            result += f'<text freecad:editable="{eq_editable[text_str]}" x="{xpos}" y="{ypos}" transform="translate(0,{0.35*text_height})" id="{text_id}" style="font-size: {text_height}pt; text-anchor: {anchor}; fill: black; font-family: osifont"><tspan>x</tspan></text>\n'
-    elif cmd == "polygon":
-        path_id = "none"
-        path_rotate = "0"
-        path_line = 0.35
-        thru_list = []
-        xp, yp = [0,0]
-        for item in ast[1:]:
-            if item[0] == "name":
-                path_id = item[1]
-            elif item[0] == "rotate":
-                path_rotate = 360-item[1]
-            elif item[0] == "pos":
-                xp, yp = parse_coord(item)
-            elif item[0] == "linewidth":
-                path_line = item[1]
-            elif item[0] == "pts":
-                for pt in item[1:]:
-                    thru_list.append([pt[1],pt[2]])
-            plist_str = ""
-            for xy in thru_list:
-                plist_str += str(xy[0]) + "," + str(xy[1]) + " "
-        result += f'<g transform="translate({xp},{yp})"><polygon id="{path_id}" transform="rotate({path_rotate})" points="{plist_str}" style="fill: solid black; stroke-width: {0.75*path_line}pt; stroke-linecap: round; stroke-linejoin: round;"/></g>\n'
-    return result
-
-def parse_coord(c):
+        # NOTE: dy="{0.35*text_height}pt" compensates for differences between osifont and KiCAD's typical font geometry
+        out += _TEXT_FMT(_f(xpos), _f(ypos), _f(0.35*text_height), text_id, _f(text_height), anchor, text_str).encode()
+    else: # editable text
+        out += _EDIT_TEXT_FMT(mapped, _f(xpos), _f(ypos), _f(0.35*text_height), text_id, _f(text_height), anchor).encode()
+
+def _emit_polygon(ast, ctx, out):
+    # same single-pass attribute indexing as tbtext
+    attrs = {item[0]: item for item in ast[1:] if isinstance(item, list)}
+    path_id = attrs["name"][1] if "name" in attrs else "none"
+    path_rotate = 360-attrs["rotate"][1] if "rotate" in attrs else "0"
+    path_line = attrs["linewidth"][1] if "linewidth" in attrs else 0.35
+    if "pos" in attrs:
+        xp, yp = parse_coord(attrs["pos"], ctx)
+    else:
+        xp, yp = 0, 0
+    pts = attrs.get("pts")
+    thru_list = [(pt[1], pt[2]) for pt in pts[1:]] if pts else []
+    # assemble the point list once, after all attributes have been scanned;
+    # the %-template is parsed once and reused for every vertex, and %g
+    # trims trailing zeros from the coordinates
+    plist_str = " ".join("%g,%g" % pt for pt in thru_list)
+    out += _POLYGON_FMT(_f(xp), _f(yp), path_id, path_rotate, plist_str, _f(0.75*path_line)).encode()
+
+# one hash lookup per element instead of walking an if/elif ladder of
+# string compares for every command
+_HANDLERS = {
+    "setup": _emit_setup,
+    "line": _emit_line,
+    "rect": _emit_rect,
+    "tbtext": _emit_tbtext,
+    "polygon": _emit_polygon,
+}
+
+def to_svg(ast, ctx, out):
+    # ast transformer to convert tokens to svg
+    # fragments are appended to out (a bytearray) already utf-8 encoded, so
+    # the final write needs no join and no encode pass over the whole svg
+    cmd = ast[0]
+    if cmd == "page_layout":
+        out += _HEADER_FMT(ctx.pw, ctx.ph).encode()
+        for sub_ast in ast[1:]:
+            to_svg(sub_ast, ctx, out)
+        out += b"</svg>\n"
+    else:
+        handler = _HANDLERS.get(cmd)
+        if handler:
+            handler(ast, ctx, out)
+
+# corner keywords resolved to small ints once, so the numeric kernel
+# below only ever sees numbers
+_CORNER_CODES = {"ltcorner": 0, "lbcorner": 1, "rtcorner": 2, "rbcorner": 3}
+
+@njit(cache=True)
+def _transform_coord(xi, yi, rel, lm, rm, tm, bm, pw, ph):
+    # pure arithmetic on the hottest path: called for every line endpoint,
+    # rect corner, text position and polygon anchor
+    if rel == 0:
+        x = xi+lm
+        y = yi+tm
+    elif rel == 1:
+        x = xi+lm
+        y = -1*yi+ph-bm
+    elif rel == 2:
+        x = -1*xi+pw-rm
+        y = yi+tm
+    else:
+        x = pw-xi-rm
+        y = -1*yi+ph-bm
+    return x, y
+
+def parse_coord(c, ctx):
     # coordinates are specified relative to any one of the 4 page corners
     # This is an 'interesting' design choice.
     if len(c) == 4:
-        rel = c[3]
-    elif len(c) == 3:
-        rel = "rbcorner"
-    xi = c[1]
-    yi = c[2]
-    if rel == "ltcorner":
-        x = xi+LEFT_MARGIN
-        y = yi+TOP_MARGIN
-    elif rel == "lbcorner":
-        x = xi+LEFT_MARGIN
-        y = -1*yi+PAGE_SIZE[1]-BOTTOM_MARGIN
-    elif rel == "rtcorner":
-        x = -1*xi+PAGE_SIZE[0]-RIGHT_MARGIN
-        y = yi+TOP_MARGIN
-    elif rel == "rbcorner":
-        x = PAGE_SIZE[0]-xi-RIGHT_MARGIN
-        y = -1*yi+PAGE_SIZE[1]-BOTTOM_MARGIN
-    return [x,y]
+        rel = _CORNER_CODES[c[3]]
+    else:
+        rel = 3
+    pc = ctx.pc
+    if pc is not None:
+        return pc(c[1], c[2], rel)
+    # no setup block seen yet; fall back to the generic kernel
+    return _transform_coord(c[1], c[2], rel, ctx.lm, ctx.rm, ctx.tm, ctx.bm, ctx.pw, ctx.ph)
+
+def convert(srcfile):
+    # convert a single worksheet; each file is fully independent, so the
+    # main block can farm these out to worker processes
+    pagetype = srcfile.split("_")[0]
+    page_size = iso_pages.get(pagetype)
+    if page_size is None:
+        return "Skipping "+srcfile+": unknown page size "+pagetype
+    srcpath = os.path.join("kicad-templates/Worksheets", srcfile)
+    outfile = os.path.join("out",srcfile[:-10]+".svg")
+    # incremental runs: nothing to do if the output is newer than the source
+    if os.path.exists(outfile) and os.path.getmtime(outfile) >= os.path.getmtime(srcpath):
+        return "Skipping "+srcfile+": "+outfile+" is up to date"
+    ctx = Ctx()
+    ctx.pw, ctx.ph = page_size
+    # read the whole file in one go and get the token list
+    contents = Path(srcpath).read_text(encoding="utf-8")
+    x = parse(contents)
+    buf = bytearray()
+    to_svg(x, ctx, buf)
+    # dump the already-encoded buffer with a single write, skipping the
+    # io layer's buffering and text encoding
+    fd = os.open(outfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, buf)
+    finally:
+        os.close(fd)
+    return "Successfully exported to "+outfile
+
+def main():
+    # only works with some of the tempaltees for now
+    files = [f for f in os.listdir("kicad-templates/Worksheets") if f.startswith("A")]
+    with ProcessPoolExecutor() as ex:
+        for result in ex.map(convert, files):
+            print(result)
 
 if __name__ == "__main__":
-    for srcfile in os.listdir("kicad-templates/Worksheets"):
-        # only works with some of the tempaltees for now
-        if not srcfile.startswith("A"):
-            continue
-        pagetype = srcfile.split("_")[0]
-        global PAGE_SIZE
-        PAGE_SIZE = iso_pages[pagetype]
-        # open the file and get the token list
-        f = open(os.path.join("kicad-templates/Worksheets",srcfile),'r')
-        contents = f.read()
-        x = parse(contents)
-        #pprint(x)
-        svgstr = to_svg(x)
-        outfile = os.path.join("out",srcfile[:-10]+".svg")
-        with open(outfile,'w') as g:
-            g.write(svgstr)
-        print("Successfully exported to "+outfile)
\ No newline at end of file
+    main()